@@ -0,0 +1,42 @@
+"""Shared OpenAI client - one HTTP/2 connection pool for ingestion and the agent."""
+
+import os
+import httpx
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
+import _env
+from tenacity import wait_exponential_jitter
+
+# Retry policy for completion calls (timeouts are a subclass of APIConnectionError)
+MAX_RETRIES = 3
+RETRY_MAX_WAIT = 30
+API_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+_client = None
+
+
+def get_client() -> OpenAI:
+    """Shared OpenAI client so every caller reuses one HTTP connection pool."""
+    global _client
+    if _client is None:
+        _env.load()
+        # HTTP/2 multiplexes the concurrent workers over a few connections instead of one TLS handshake each
+        http_client = httpx.Client(http2=True, timeout=90,
+                                   limits=httpx.Limits(max_connections=200, max_keepalive_connections=100,
+                                                       keepalive_expiry=300))
+        # Callers retry with the tenacity policy below; SDK retries would nest under it
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=90, max_retries=0, http_client=http_client)
+    return _client
+
+
+_backoff = wait_exponential_jitter(initial=1, max=RETRY_MAX_WAIT)
+
+
+def wait_for_retry(retry_state) -> float:
+    """Honor the server's Retry-After hint when present, else back off with jitter."""
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    if response is not None:
+        try:
+            return min(float(response.headers.get("retry-after")), RETRY_MAX_WAIT)
+        except (TypeError, ValueError):
+            pass
+    return _backoff(retry_state)
@@ -0,0 +1,10 @@
+"""Shared .env loading - parsed at most once per process, however many modules ask for it."""
+
+import functools
+from dotenv import load_dotenv
+
+
+@functools.cache
+def load() -> bool:
+    """Read .env on first use rather than at import, so importing callers stays cheap."""
+    return load_dotenv()
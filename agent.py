@@ -1,33 +1,41 @@
 #!/usr/bin/env python3
 """Financial Research Agent - Multi-turn conversational AI with semantic search."""
 import sqlite3
-import json
-from openai import OpenAI
-from dotenv import load_dotenv
+import orjson
+import functools
+from pathlib import Path
+import _env
 import os
 import chromadb
 from chromadb.utils import embedding_functions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt
+from _client import API_ERRORS, MAX_RETRIES, get_client, wait_for_retry
 
-load_dotenv()
-
-DB_PATH = "data/database/financial_data.db"
-VECTORDB_PATH = "data/vectordb"
+# Resolved once from this file's location so the agent works from any working directory
+DATA_DIR = Path(__file__).resolve().parent / "data"
+DB_PATH = DATA_DIR / "database" / "financial_data.db"
+VECTORDB_PATH = DATA_DIR / "vectordb"
+MODEL = "gpt-5"
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 
 class FinancialAgent:
     def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=60)
+        _env.load()
+        self.client = get_client().with_options(timeout=60)
         self.db = sqlite3.connect(DB_PATH)
         self.db.row_factory = sqlite3.Row
         self.conversation = []
         self.tools = self._define_tools()
+        # The agent never writes, so found companies can be cached for the session; misses raise and are not cached
+        self._cached_company = functools.lru_cache(maxsize=256)(self._lookup_company)
         
         # ChromaDB for semantic search
         if os.path.exists(VECTORDB_PATH):
             self.chroma = chromadb.PersistentClient(path=VECTORDB_PATH)
             openai_ef = embedding_functions.OpenAIEmbeddingFunction(
                 api_key=os.getenv("OPENAI_API_KEY"),
-                model_name="text-embedding-3-small"
+                model_name=EMBEDDING_MODEL
             )
             self.qualitative_collection = self.chroma.get_or_create_collection(
                 name="qualitative",
@@ -169,11 +177,24 @@ CRITICAL FOR SEMANTIC SEARCH:
         except Exception as e:
             return {"error": str(e)}
 
-    def get_company_metrics(self, company_name: str):
+    def _lookup_company(self, company_name: str) -> dict:
+        """First company whose name contains company_name, as a plain dict so it can be cached."""
         company = self.db.execute(
-            "SELECT id, name, sector FROM companies WHERE name LIKE ?", 
+            "SELECT id, name, sector FROM companies WHERE name LIKE ?",
             (f"%{company_name}%",)
         ).fetchone()
+        if company is None:
+            raise LookupError(company_name)
+        return dict(company)
+
+    def _find_company(self, company_name: str):
+        try:
+            return self._cached_company(company_name)
+        except LookupError:
+            return None  # re-queried next time, e.g. once ingestion has added the company
+
+    def get_company_metrics(self, company_name: str):
+        company = self._find_company(company_name)
         if not company:
             return {"error": f"Company '{company_name}' not found. Use query_database to list all companies."}
         
@@ -189,10 +210,7 @@ CRITICAL FOR SEMANTIC SEARCH:
         return result
 
     def get_time_series(self, company_name: str, table_name: str):
-        company = self.db.execute(
-            "SELECT id, name FROM companies WHERE name LIKE ?",
-            (f"%{company_name}%",)
-        ).fetchone()
+        company = self._find_company(company_name)
         if not company:
             return {"error": f"Company '{company_name}' not found"}
         
@@ -244,18 +262,24 @@ CRITICAL FOR SEMANTIC SEARCH:
             return self.query_database(args["sql"])
         return {"error": "Unknown tool"}
 
+    @retry(stop=stop_after_attempt(MAX_RETRIES), wait=wait_for_retry, retry=retry_if_exception_type(API_ERRORS),
+           reraise=True)
+    def _complete(self, messages: list):
+        """One tool-enabled completion; transient API failures are retried with jittered backoff."""
+        return self.client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            tools=self.tools,
+            tool_choice="auto",
+        )
+
     def ask(self, question: str) -> str:
         """Process a question with multi-turn context."""
         self.conversation.append({"role": "user", "content": question})
         
         messages = [{"role": "system", "content": self.system_prompt}] + self.conversation
         
-        response = self.client.chat.completions.create(
-            model="gpt-5",
-            messages=messages,
-            tools=self.tools,
-            tool_choice="auto",
-        )
+        response = self._complete(messages)
         
         msg = response.choices[0].message
         
@@ -264,21 +288,16 @@ CRITICAL FOR SEMANTIC SEARCH:
             self.conversation.append(msg)
             
             for tc in msg.tool_calls:
-                args = json.loads(tc.function.arguments) if tc.function.arguments else {}
+                args = orjson.loads(tc.function.arguments) if tc.function.arguments else {}
                 result = self._execute_tool(tc.function.name, args)
                 self.conversation.append({
                     "role": "tool",
                     "tool_call_id": tc.id,
-                    "content": json.dumps(result, default=str)
+                    "content": orjson.dumps(result, default=str).decode()
                 })
             
             messages = [{"role": "system", "content": self.system_prompt}] + self.conversation
-            response = self.client.chat.completions.create(
-                model="gpt-5",
-                messages=messages,
-                tools=self.tools,
-                tool_choice="auto",
-            )
+            response = self._complete(messages)
             msg = response.choices[0].message
         
         answer = msg.content
@@ -286,8 +305,9 @@ CRITICAL FOR SEMANTIC SEARCH:
         return answer
 
     def reset(self):
-        """Clear conversation history."""
+        """Clear conversation history and cached company lookups."""
         self.conversation = []
+        self._cached_company.cache_clear()
 
 
 def main():
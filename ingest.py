@@ -3,19 +3,33 @@
 
 from pathlib import Path
 import sys
-import json
+import orjson
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import chain
 from openai import OpenAI
-import pdfplumber
-from dotenv import load_dotenv
+import pymupdf
+import _env
 import os
 import sqlite3
 import threading
+import queue
+from tenacity import retry, retry_if_exception_type, stop_after_attempt
 import chromadb
 from chromadb.utils import embedding_functions
+from _client import API_ERRORS, MAX_RETRIES, get_client, wait_for_retry
 
-load_dotenv()
+# PyMuPDF >= 1.26 prints a pymupdf_layout recommendation to stdout once per process, i.e. once per extraction worker
+if hasattr(pymupdf, "no_recommend_layout"):
+    pymupdf.no_recommend_layout()
+
+# Resolved once from this file's location so ingestion works from any working directory
+DATA_DIR = Path(__file__).resolve().parent / "data"
+PDF_DIR = DATA_DIR / "pdfs"
+DB_PATH = DATA_DIR / "database" / "financial_data.db"
+VECTORDB_PATH = DATA_DIR / "vectordb"
+EXTRACTION_MODEL = "gpt-5"
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 # Schema prompts for each page type
 PROMPTS = {
@@ -57,192 +71,306 @@ Return JSON. Use null for missing.""",
 Return JSON. Skip disclaimer.""",
 }
 
+# Page-1 metric fields: point-in-time market data with its unit, per-quarter shareholding, forecast periods
+MARKET_FIELDS = (
+    ("cmp", "INR"), ("target_price", "INR"), ("market_cap_cr", "cr"), ("enterprise_value_cr", "cr"),
+    ("week_52_high", "INR"), ("week_52_low", "INR"), ("beta", "INR"), ("face_value", "INR"),
+    ("free_float_pct", "pct"), ("dividend_yield_pct", "pct"),
+)
+SHAREHOLDING_FIELDS = ("promoter_pct", "fii_pct", "mf_pct", "public_pct", "others_pct")
+FORECAST_PERIODS = (("fy24a", "FY24A"), ("fy25e", "FY25E"), ("fy26e", "FY26E"))  # (response key, stored period)
+
+# Time-series tables extracted from each page
+PAGE_TABLES = {
+    2: ("quarterly_pnl", "segment_revenue"),
+    3: ("annual_pnl", "balance_sheet", "cash_flow", "ratios"),
+}
+
+# Keys a time-series row may use for its label, in priority order
+METRIC_KEYS = ("metric", "item", "ratio", "name")
+
+# Extraction calls also retry when the model returns malformed JSON
+RETRYABLE_ERRORS = API_ERRORS + (orjson.JSONDecodeError,)
+
+# Write statements, kept as shared constants so every call hits sqlite3's per-connection statement cache
+SQL_UPSERT_COMPANY = """INSERT INTO companies (name, sector, bse_code, nse_code, bloomberg_code) VALUES (?,?,?,?,?)
+    ON CONFLICT(name) DO UPDATE SET sector=excluded.sector"""
+# Upsert (not REPLACE) so a re-ingested PDF keeps its document id and its pages replace that document's rows
+SQL_UPSERT_DOCUMENT = """INSERT INTO documents (filename, company_id, report_date, report_type, rating) VALUES (?,?,?,?,?)
+    ON CONFLICT(filename) DO UPDATE SET company_id=excluded.company_id, report_date=excluded.report_date,
+    report_type=excluded.report_type, rating=excluded.rating"""
+SQL_INSERT_METRIC = "INSERT INTO metrics (company_id, document_id, field_name, value, unit, time_period) VALUES (?,?,?,?,?,?)"
+SQL_INSERT_TIME_SERIES = "INSERT INTO time_series (company_id, document_id, table_name, metric, period, value, unit) VALUES (?,?,?,?,?,?,?)"
+SQL_INSERT_QUALITATIVE = "INSERT INTO qualitative (company_id, document_id, chunk_type, content, page_num) VALUES (?,?,?,?,?)"
+# A re-ingested page replaces its document's previous rows in the same transaction. Row labels such as
+# "% change" legitimately repeat within a table, so there is no natural key to dedupe individual rows on.
+SQL_DELETE_METRICS = "DELETE FROM metrics WHERE document_id = ?"
+SQL_DELETE_TIME_SERIES = "DELETE FROM time_series WHERE document_id = ? AND table_name = ?"
+SQL_DELETE_QUALITATIVE = "DELETE FROM qualitative WHERE document_id = ? AND page_num = ? AND chunk_type = ?"
+
+# Read-side indexes ingestion itself doesn't use; deferred during bulk loads
+SECONDARY_INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_metrics_company_field ON metrics(company_id, field_name, time_period);
+"""
+DROP_SECONDARY_INDEXES = """
+    DROP INDEX IF EXISTS idx_metrics_company_field;
+"""
+
+# Max chunks per ChromaDB add (one embeddings request)
+CHROMA_BATCH_SIZE = 64
+
+# No per-line flush: stdout's own buffering keeps log writes off the workers' critical path
 print_lock = threading.Lock()
 def log(msg):
     with print_lock:
-        print(f"[{time.strftime('%H:%M:%S')}] {msg}", flush=True)
+        print(f"[{time.strftime('%H:%M:%S')}] {msg}")
+
+
+def _iter_metric_rows(company_id: int, doc_id: int, data: dict):
+    """Yield metrics rows for a page-1 extraction, skipping missing values."""
+    for field, unit in MARKET_FIELDS:
+        val = data.get(field)
+        if val is not None:
+            yield (company_id, doc_id, field, val, unit, None)
+    for q in data.get("shareholding") or ():
+        qtr = q.get("quarter", "unknown")
+        for field in SHAREHOLDING_FIELDS:
+            val = q.get(field)
+            if val is not None:
+                yield (company_id, doc_id, field, val, "pct", qtr)
+    for f in data.get("forecasts") or ():
+        metric = (f.get("metric") or "unknown").lower().replace(" ", "_")
+        unit = f.get("unit", "cr")
+        for period, label in FORECAST_PERIODS:
+            val = f.get(period)
+            if val is not None:
+                yield (company_id, doc_id, f"{metric}_{period}", val, unit, label)
+
+
+def _iter_time_series_rows(company_id: int, doc_id: int, tables: dict):
+    """Yield time_series rows for {table_name: data}, pairing each value with its period."""
+    for table_name, data in tables.items():
+        if not data:
+            continue
+        periods = data.get("periods") or []
+        for row in chain(data.get("rows") or (), data.get("assets") or (), data.get("liabilities") or (), data.get("segments") or ()):
+            metric = next((row[k] for k in METRIC_KEYS if row.get(k)), "unknown").lower().replace(" ", "_")
+            unit = row.get("unit", "cr")
+            for period, val in zip(periods, row.get("values") or ()):
+                if val is not None:
+                    yield (company_id, doc_id, table_name, metric, period, val, unit)
 
 
 class Database:
-    def __init__(self, path="data/database/financial_data.db"):
+    def __init__(self, path=DB_PATH, bulk_load: bool = False):
+        _env.load()
         Path(path).parent.mkdir(parents=True, exist_ok=True)
-        self.conn = sqlite3.connect(path, check_same_thread=False)
-        self.lock = threading.Lock()
-        self.conn.row_factory = sqlite3.Row
+        self.path = path
+        self.bulk_load = bulk_load
+        # A from-scratch rebuild can skip fsyncs entirely: on a crash the DB is simply re-ingested
+        synchronous = "OFF" if bulk_load else os.getenv("SQLITE_SYNC", "NORMAL")
+        self._pragmas = (f"PRAGMA journal_mode={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')}; PRAGMA synchronous={synchronous}; "
+                         "PRAGMA temp_store=MEMORY; PRAGMA cache_size=-65536; PRAGMA mmap_size=268435456;")
+        self._local = threading.local()
+        self._stats, self._stats_at = None, 0.0
+        self._company_ids = {}  # company name -> id, so repeat companies skip the id lookup
         self._create_tables()
         
         # ChromaDB for semantic search
-        self.chroma = chromadb.PersistentClient(path="data/vectordb")
+        self.chroma = chromadb.PersistentClient(path=VECTORDB_PATH)
         openai_ef = embedding_functions.OpenAIEmbeddingFunction(
             api_key=os.getenv("OPENAI_API_KEY"),
-            model_name="text-embedding-3-small"
+            model_name=EMBEDDING_MODEL
         )
         self.qualitative_collection = self.chroma.get_or_create_collection(
             name="qualitative",
             embedding_function=openai_ef
         )
+        # Embedding happens on a background writer so workers don't wait on the embeddings API
+        self._chroma_q = queue.Queue(maxsize=1024)
+        threading.Thread(target=self._chroma_writer, daemon=True).start()
+    
+    def _conn(self) -> sqlite3.Connection:
+        """Per-thread connection; in WAL mode readers never wait on the writer and writers queue on busy_timeout."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, cached_statements=256)
+            conn.executescript(self._pragmas)
+            self._local.conn = conn
+        return conn
     
     def _create_tables(self):
-        self.conn.executescript("""
+        conn = self._conn()
+        conn.executescript("""
             CREATE TABLE IF NOT EXISTS companies (id INTEGER PRIMARY KEY, name TEXT UNIQUE, sector TEXT, bse_code TEXT, nse_code TEXT, bloomberg_code TEXT);
             CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, company_id INTEGER, report_date TEXT, report_type TEXT, rating TEXT);
             CREATE TABLE IF NOT EXISTS metrics (id INTEGER PRIMARY KEY, company_id INTEGER, document_id INTEGER, field_name TEXT, value REAL, unit TEXT, time_period TEXT);
             CREATE TABLE IF NOT EXISTS time_series (id INTEGER PRIMARY KEY, company_id INTEGER, document_id INTEGER, table_name TEXT, metric TEXT, period TEXT, value REAL, unit TEXT);
             CREATE TABLE IF NOT EXISTS qualitative (id INTEGER PRIMARY KEY, company_id INTEGER, document_id INTEGER, chunk_type TEXT, content TEXT, page_num INTEGER);
-            CREATE INDEX IF NOT EXISTS idx_metrics_company ON metrics(company_id);
             CREATE INDEX IF NOT EXISTS idx_ts_company ON time_series(company_id);
+            -- Serve the per-document deletes that replace a re-ingested page's rows
+            CREATE INDEX IF NOT EXISTS idx_metrics_document ON metrics(document_id);
+            CREATE INDEX IF NOT EXISTS idx_ts_document ON time_series(document_id, table_name);
+            CREATE INDEX IF NOT EXISTS idx_qualitative_document ON qualitative(document_id, page_num, chunk_type);
+            -- Subsumed by idx_metrics_company_field
+            DROP INDEX IF EXISTS idx_metrics_company;
         """)
-        self.conn.commit()
+        # Bulk rebuilds skip secondary indexes while inserting; finalize() builds them once at the end
+        conn.executescript(DROP_SECONDARY_INDEXES if self.bulk_load else SECONDARY_INDEXES)
+        conn.commit()
     
     def save_page1(self, filename: str, data: dict) -> tuple:
-        with self.lock:
-            cur = self.conn.cursor()
-            cur.execute("""INSERT INTO companies (name, sector, bse_code, nse_code, bloomberg_code) 
-                          VALUES (?,?,?,?,?) ON CONFLICT(name) DO UPDATE SET sector=excluded.sector RETURNING id""",
-                       (data.get("company_name"), data.get("sector"), data.get("bse_code"), 
-                        data.get("nse_code"), data.get("bloomberg_code")))
-            company_id = cur.fetchone()[0]
-            cur.execute("INSERT OR REPLACE INTO documents (filename, company_id, report_date, report_type, rating) VALUES (?,?,?,?,?)",
-                       (filename, company_id, data.get("report_date"), "quarterly", data.get("rating")))
-            doc_id = cur.lastrowid
-            
-            # Market metrics
-            for field in ["cmp", "target_price", "market_cap_cr", "enterprise_value_cr", 
-                         "week_52_high", "week_52_low", "beta", "face_value",
-                         "free_float_pct", "dividend_yield_pct"]:
-                val = data.get(field)
-                if val is not None:
-                    unit = "cr" if "_cr" in field else ("pct" if "_pct" in field else "INR")
-                    cur.execute("INSERT INTO metrics (company_id, document_id, field_name, value, unit) VALUES (?,?,?,?,?)",
-                               (company_id, doc_id, field, val, unit))
-            
-            # Shareholding
-            for q in data.get("shareholding") or []:
-                qtr = q.get("quarter", "unknown")
-                for field in ["promoter_pct", "fii_pct", "mf_pct", "public_pct", "others_pct"]:
-                    val = q.get(field)
-                    if val is not None:
-                        cur.execute("INSERT INTO metrics (company_id, document_id, field_name, value, unit, time_period) VALUES (?,?,?,?,?,?)",
-                                   (company_id, doc_id, field, val, "pct", qtr))
+        # Commits on success and rolls back on error, so a failed page never leaves a transaction open
+        with self._conn() as conn:
+            cur = conn.cursor()
+            name = data.get("company_name")
+            cur.execute(SQL_UPSERT_COMPANY,
+                        (name, data.get("sector"), data.get("bse_code"),
+                         data.get("nse_code"), data.get("bloomberg_code")))
+            if name is None:
+                company_id = cur.lastrowid  # a NULL name never conflicts, so the upsert was a fresh insert
+            else:
+                company_id = (self._company_ids.get(name)
+                              or cur.execute("SELECT id FROM companies WHERE name = ?", (name,)).fetchone()[0])
+            cur.execute(SQL_UPSERT_DOCUMENT, (filename, company_id, data.get("report_date"), "quarterly", data.get("rating")))
+            doc_id = cur.execute("SELECT id FROM documents WHERE filename = ?", (filename,)).fetchone()[0]
             
-            # Forecasts
-            for f in data.get("forecasts") or []:
-                metric = (f.get("metric") or "unknown").lower().replace(" ", "_")
-                unit = f.get("unit", "cr")
-                for period in ["fy24a", "fy25e", "fy26e"]:
-                    val = f.get(period)
-                    if val is not None:
-                        cur.execute("INSERT INTO metrics (company_id, document_id, field_name, value, unit, time_period) VALUES (?,?,?,?,?,?)",
-                                   (company_id, doc_id, f"{metric}_{period}", val, unit, period.upper()))
+            cur.execute(SQL_DELETE_METRICS, (doc_id,))
+            cur.execute(SQL_DELETE_QUALITATIVE, (doc_id, 1, "business_overview"))
+            cur.executemany(SQL_INSERT_METRIC, _iter_metric_rows(company_id, doc_id, data))
             
-            # Qualitative (SQLite + ChromaDB - always flush)
+            # Qualitative (SQLite now, ChromaDB via the background writer after commit)
             content = data.get("business_overview") or data.get("business_highlights")
             if content:
-                cur.execute("INSERT INTO qualitative (company_id, document_id, chunk_type, content, page_num) VALUES (?,?,?,?,?)",
-                           (company_id, doc_id, "business_overview", content, 1))
-                # Flush to ChromaDB immediately
-                doc_id_str = f"{data.get('company_name', 'unknown')}_{doc_id}_p1"
-                try:
-                    self.qualitative_collection.add(
-                        documents=[content],
-                        ids=[doc_id_str],
-                        metadatas=[{"company": data.get("company_name", ""), "page": 1, "type": "business_overview"}]
-                    )
-                except Exception:
-                    pass
-            
-            self.conn.commit()
-            return company_id, doc_id
+                cur.execute(SQL_INSERT_QUALITATIVE, (company_id, doc_id, "business_overview", content, 1))
+        
+        # Only cache ids once committed; a rolled-back insert's id could be reused
+        if name is not None:
+            self._company_ids[name] = company_id
+        if content:
+            doc_id_str = f"{data.get('company_name', 'unknown')}_{doc_id}_p1"
+            self._chroma_q.put((content, doc_id_str, {"company": data.get("company_name", ""), "page": 1, "type": "business_overview"}))
+        return company_id, doc_id
     
     def save_time_series(self, company_id: int, doc_id: int, table_name: str, data: dict):
-        if not data:
-            return
-        with self.lock:
-            cur = self.conn.cursor()
-            periods = data.get("periods") or []
-            for row in (data.get("rows") or []) + (data.get("assets") or []) + (data.get("liabilities") or []) + (data.get("segments") or []):
-                metric = (row.get("metric") or row.get("item") or row.get("ratio") or row.get("name") or "unknown").lower().replace(" ", "_")
-                values = row.get("values") or []
-                unit = row.get("unit", "cr")
-                for i, val in enumerate(values):
-                    if val is not None and i < len(periods):
-                        cur.execute("INSERT INTO time_series (company_id, document_id, table_name, metric, period, value, unit) VALUES (?,?,?,?,?,?,?)",
-                                   (company_id, doc_id, table_name, metric, periods[i], val, unit))
-            self.conn.commit()
+        self.save_time_series_tables(company_id, doc_id, {table_name: data})
+    
+    def save_time_series_tables(self, company_id: int, doc_id: int, tables: dict):
+        """Save several {table_name: data} statements from one page in a single transaction."""
+        with self._conn() as conn:
+            conn.executemany(SQL_DELETE_TIME_SERIES, [(doc_id, table_name) for table_name in tables])
+            conn.executemany(SQL_INSERT_TIME_SERIES, _iter_time_series_rows(company_id, doc_id, tables))
     
     def save_qualitative(self, company_id: int, doc_id: int, content: str, chunk_type: str, page_num: int, company_name: str = ""):
-        if not content:
-            return
-        with self.lock:
-            cur = self.conn.cursor()
-            cur.execute("INSERT INTO qualitative (company_id, document_id, chunk_type, content, page_num) VALUES (?,?,?,?,?)",
-                       (company_id, doc_id, chunk_type, content, page_num))
-            self.conn.commit()
-            # Flush to ChromaDB immediately
-            if chunk_type != "rating_history":
-                doc_id_str = f"{company_name}_{doc_id}_p{page_num}_{chunk_type}"
+        self.save_qualitative_chunks(company_id, doc_id, [content], chunk_type, page_num, company_name)
+    
+    def save_qualitative_chunks(self, company_id: int, doc_id: int, chunks: list, chunk_type: str, page_num: int, company_name: str = ""):
+        """Save same-type chunks from one page in a single transaction."""
+        chunks = [c for c in chunks if c]
+        with self._conn() as conn:
+            conn.execute(SQL_DELETE_QUALITATIVE, (doc_id, page_num, chunk_type))
+            conn.executemany(SQL_INSERT_QUALITATIVE, [(company_id, doc_id, chunk_type, content, page_num) for content in chunks])
+        if chunk_type != "rating_history":
+            for i, content in enumerate(chunks):
+                doc_id_str = f"{company_name}_{doc_id}_p{page_num}_{chunk_type}" + (f"_{i}" if i else "")
+                self._chroma_q.put((content, doc_id_str, {"company": company_name, "page": page_num, "type": chunk_type}))
+    
+    def _chroma_writer(self):
+        """Drain queued chunks into ChromaDB, batching whatever has accumulated since the last add."""
+        while True:
+            batch = [self._chroma_q.get()]
+            while len(batch) < CHROMA_BATCH_SIZE:
                 try:
-                    self.qualitative_collection.add(
-                        documents=[content],
-                        ids=[doc_id_str],
-                        metadatas=[{"company": company_name, "page": page_num, "type": chunk_type}]
-                    )
-                except Exception:
-                    pass
+                    batch.append(self._chroma_q.get_nowait())
+                except queue.Empty:
+                    break
+            documents, ids, metadatas = (list(col) for col in zip(*batch))
+            try:
+                self.qualitative_collection.add(documents=documents, ids=ids, metadatas=metadatas)
+            except Exception:
+                # Retry one by one so a single bad chunk (e.g. a duplicate id) doesn't drop the batch
+                for doc, doc_id_str, metadata in batch:
+                    try:
+                        self.qualitative_collection.add(documents=[doc], ids=[doc_id_str], metadatas=[metadata])
+                    except Exception:
+                        pass
+            for _ in batch:
+                self._chroma_q.task_done()
+    
+    def flush_vectors(self):
+        """Block until every queued chunk has been written to ChromaDB."""
+        self._chroma_q.join()
+    
+    def finalize(self):
+        """Build any deferred secondary indexes and refresh planner statistics after a bulk write."""
+        self._conn().executescript(SECONDARY_INDEXES + "ANALYZE;")
     
     def get_company_doc(self, filename: str):
         """Get company_id and doc_id for a filename."""
-        with self.lock:
-            row = self.conn.execute("SELECT company_id, id FROM documents WHERE filename = ?", (filename,)).fetchone()
-            return (row["company_id"], row["id"]) if row else (None, None)
+        row = self._conn().execute("SELECT company_id, id FROM documents WHERE filename = ?", (filename,)).fetchone()
+        return (row[0], row[1]) if row else (None, None)
     
-    def get_stats(self):
-        with self.lock:
-            return {
-                "companies": self.conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0],
-                "metrics": self.conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0],
-                "time_series": self.conn.execute("SELECT COUNT(*) FROM time_series").fetchone()[0],
-                "qualitative": self.conn.execute("SELECT COUNT(*) FROM qualitative").fetchone()[0],
-            }
+    def get_stats(self, max_age: float = 0) -> dict:
+        """Row counts per table; reuses the previous counts if they are younger than max_age seconds."""
+        if self._stats and time.monotonic() - self._stats_at < max_age:
+            return self._stats
+        conn = self._conn()
+        self._stats = {
+            "companies": conn.execute("SELECT COUNT(*) FROM companies").fetchone()[0],
+            "metrics": conn.execute("SELECT COUNT(*) FROM metrics").fetchone()[0],
+            "time_series": conn.execute("SELECT COUNT(*) FROM time_series").fetchone()[0],
+            "qualitative": conn.execute("SELECT COUNT(*) FROM qualitative").fetchone()[0],
+        }
+        self._stats_at = time.monotonic()
+        return self._stats
 
 
 def extract_pdf_pages(pdf_path: Path) -> list:
     """Extract text from all pages of a PDF."""
     pages = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for i, page in enumerate(pdf.pages[:4]):  # Only first 4 pages
-            text = page.extract_text() or ""
-            tables = page.extract_tables() or []
+    with pymupdf.open(pdf_path) as doc:
+        for page in doc.pages(0, min(4, doc.page_count)):  # Only first 4 pages
+            # Reading order (not content-stream order), with layout padding collapsed so the prompt caps cut what they used to
+            text = "\n".join(" ".join(line.split()) for line in page.get_text(sort=True).splitlines())
+            tables = [t.extract() for t in page.find_tables().tables]
             table_text = "\n".join(" | ".join(str(c) if c else "" for c in row) for table in tables for row in table if row)
-            pages.append({"page_num": i + 1, "text": text, "table_text": table_text})
+            pages.append({"page_num": page.number + 1, "text": text, "table_text": table_text})
     return pages
 
 
-def process_and_save_page(client: OpenAI, db: Database, pdf_name: str, page_num: int, text: str, table_text: str, pending_pages: dict, max_retries: int = 3) -> dict:
+def _log_retry(retry_state):
+    log(f"RETRY {retry_state.kwargs.get('label', '')} attempt {retry_state.attempt_number + 1}/{MAX_RETRIES}")
+
+
+@retry(stop=stop_after_attempt(MAX_RETRIES), wait=wait_for_retry, retry=retry_if_exception_type(RETRYABLE_ERRORS),
+       before_sleep=_log_retry, reraise=True)
+def _call_gpt(client: OpenAI, page_num: int, content: str, label: str = "") -> dict:
+    """Run one extraction call; transient API failures are retried with jittered backoff."""
+    response = client.chat.completions.create(
+        model=EXTRACTION_MODEL,
+        # The page's schema prompt is a byte-identical system prefix; only the page content varies
+        messages=[{"role": "system", "content": PROMPTS[page_num]}, {"role": "user", "content": content}],
+        response_format={"type": "json_object"},
+        # Route same-page prompts together so the static schema prefix hits OpenAI's prompt cache
+        extra_body={"prompt_cache_key": f"ingest-p{page_num}"}
+    )
+    return orjson.loads(response.choices[0].message.content)
+
+
+def process_and_save_page(client: OpenAI, db: Database, pdf_name: str, page_num: int, text: str, table_text: str, pending_pages: dict) -> dict:
     """Process a single page and save immediately to DB with retry logic."""
     if page_num not in PROMPTS:
         return {"pdf": pdf_name, "page": page_num, "success": False, "error": "No prompt"}
     
-    prompt = PROMPTS[page_num] + f"\n\nText:\n{text[:6000]}\n\nTables:\n{table_text[:4000]}"
+    content = f"Text:\n{text[:6000]}\n\nTables:\n{table_text[:4000]}"
     
-    for attempt in range(max_retries):
-        try:
-            start = time.time()
-            response = client.chat.completions.create(
-                model="gpt-5",
-                messages=[{"role": "user", "content": prompt}],
-                response_format={"type": "json_object"}
-            )
-            data = json.loads(response.choices[0].message.content)
-            elapsed = time.time() - start
-            break  # Success
-        except Exception as e:
-            if attempt < max_retries - 1:
-                log(f"RETRY {pdf_name[:20]}... p{page_num} attempt {attempt+2}/{max_retries}")
-                time.sleep(2 ** attempt)  # Exponential backoff
-                continue
-            log(f"FAIL {pdf_name[:20]}... p{page_num}: {str(e)[:30]}")
-            return {"pdf": pdf_name, "page": page_num, "success": False, "error": str(e)}
+    try:
+        start = time.time()
+        data = _call_gpt(client, page_num, content, label=f"{pdf_name[:20]}... p{page_num}")
+        elapsed = time.time() - start
+    except Exception as e:
+        log(f"FAIL {pdf_name[:20]}... p{page_num}: {str(e)[:30]}")
+        return {"pdf": pdf_name, "page": page_num, "success": False, "error": str(e)}
     
     try:
         
@@ -274,21 +402,14 @@ def process_and_save_page(client: OpenAI, db: Database, pdf_name: str, page_num:
 
 
 def save_page_data(db: Database, company_id: int, doc_id: int, page_num: int, data: dict):
-    """Save non-page-1 data to DB."""
-    if page_num == 2:
-        db.save_time_series(company_id, doc_id, "quarterly_pnl", data.get("quarterly_pnl"))
-        db.save_time_series(company_id, doc_id, "segment_revenue", data.get("segment_revenue"))
-    elif page_num == 3:
-        db.save_time_series(company_id, doc_id, "annual_pnl", data.get("annual_pnl"))
-        db.save_time_series(company_id, doc_id, "balance_sheet", data.get("balance_sheet"))
-        db.save_time_series(company_id, doc_id, "cash_flow", data.get("cash_flow"))
-        db.save_time_series(company_id, doc_id, "ratios", data.get("ratios"))
+    """Save non-page-1 data to DB (one commit per page)."""
+    if page_num in PAGE_TABLES:
+        db.save_time_series_tables(company_id, doc_id, {t: data.get(t) for t in PAGE_TABLES[page_num]})
     elif page_num == 4:
-        for h in data.get("rating_history") or []:
-            db.save_qualitative(company_id, doc_id, json.dumps(h), "rating_history", 4)
+        db.save_qualitative_chunks(company_id, doc_id, [orjson.dumps(h).decode() for h in data.get("rating_history") or []], "rating_history", 4)
 
 
-def ingest_pdfs(pdf_dir: str = "data/pdfs", db_path: str = "data/database/financial_data.db", clear: bool = False, max_workers: int = 80):
+def ingest_pdfs(pdf_dir: Path = PDF_DIR, db_path: Path = DB_PATH, clear: bool = False, max_workers: int = 80):
     """
     Ingest all PDFs in parallel with immediate DB flushing.
     """
@@ -303,14 +424,14 @@ def ingest_pdfs(pdf_dir: str = "data/pdfs", db_path: str = "data/database/financ
     
     log(f"Found {len(pdfs)} PDFs")
     
-    db = Database(db_path)
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=90)
-    
-    # Extract text from all PDFs (fast, local)
+    # Extract text from all PDFs (local, CPU-bound) before any threads are started
     log("Extracting text from PDFs...")
-    pdf_pages = {}
-    for pdf in pdfs:
-        pdf_pages[pdf.name] = extract_pdf_pages(pdf)
+    # Python 3.11 starts every pool worker up front, so don't fork more processes than there are PDFs
+    with ProcessPoolExecutor(max_workers=min(len(pdfs), os.cpu_count() or 1)) as executor:
+        pdf_pages = dict(zip((pdf.name for pdf in pdfs), executor.map(extract_pdf_pages, pdfs)))
+    
+    db = Database(db_path, bulk_load=clear)
+    client = get_client()
     
     # Build tasks
     tasks = []
@@ -344,9 +465,11 @@ def ingest_pdfs(pdf_dir: str = "data/pdfs", db_path: str = "data/database/financ
             
             # Progress update every 10 pages
             if (completed + failed) % 10 == 0:
-                stats = db.get_stats()
+                stats = db.get_stats(max_age=5)
                 log(f"Progress: {completed + failed}/{len(tasks)} | DB: {stats['companies']} companies, {stats['metrics']} metrics")
     
+    db.flush_vectors()
+    db.finalize()
     elapsed = time.time() - start
     stats = db.get_stats()
     